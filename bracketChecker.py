@@ -1,32 +1,26 @@
 import os
+import re
 
-def is_commented(line, index):
-    """Check if character at index is after a # in the same line."""
-    comment_pos = line.find('#')
-    return comment_pos != -1 and index > comment_pos
+COMMENT = re.compile(rb'#[^\r\n]*')
 
 def count_braces_in_file(filepath):
-    left_count = 0
-    right_count = 0
+    # Braces and '#' are ASCII, so work on raw bytes: drop every comment in
+    # one pass, then let bytes.count do the counting.
+    with open(filepath, 'rb') as file:
+        data = COMMENT.sub(b'', file.read())
 
-    with open(filepath, 'r', encoding='utf-8') as file:
-        for line in file:
-            for idx, char in enumerate(line):
-                if char == '{' and not is_commented(line, idx):
-                    left_count += 1
-                elif char == '}' and not is_commented(line, idx):
-                    right_count += 1
-
-    return left_count, right_count
+    return data.count(b'{'), data.count(b'}')
 
 def scan_txt_files():
     mismatched_files = []
 
-    for filename in os.listdir('.'):
-        if filename.endswith('.txt') and os.path.isfile(filename):
-            left, right = count_braces_in_file(filename)
-            if left != right:
-                mismatched_files.append((filename, left, right))
+    # scandir entries cache their file type, saving a stat() per entry
+    with os.scandir('.') as entries:
+        for entry in entries:
+            if entry.name.endswith('.txt') and entry.is_file():
+                left, right = count_braces_in_file(entry.path)
+                if left != right:
+                    mismatched_files.append((entry.name, left, right))
 
     if mismatched_files:
         print("Files with mismatched brackets:")
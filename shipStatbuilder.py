@@ -1,29 +1,59 @@
 
 from vendor import pdxparser
 import pandas as pd
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import os
+import pickle
+
+@functools.lru_cache(maxsize=None)
+def _cached_parse(file_path, mtime):
+    # Parsed files are also pickled next to the source; reuse that copy as long
+    # as it is newer than both the source file and the parser itself.
+    cache_path = file_path + ".pkl"
+    if os.path.exists(cache_path) and \
+            os.path.getmtime(cache_path) > max(mtime, os.path.getmtime(pdxparser.__file__)):
+        try:
+            with open(cache_path, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            # The sidecar is only a cache; whatever is wrong with it, parse
+            # again and overwrite it.
+            pass
 
-def parse_modules(file_path):
     raw = pdxparser.pdx_parse(file_path)
+    # Write to a temporary file and swap it in, so an interrupted dump can
+    # never leave a truncated sidecar behind.
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(raw, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return raw
+
+def cached_parse(file_path):
+    return _cached_parse(file_path, os.path.getmtime(file_path))
+
+def parse_modules(file_path):
+    raw = cached_parse(file_path)
     return raw.get('equipment_modules', [None, {}])[1]
 
 def parse_ships(file_path):
-    raw_lines = []
-    with open(file_path, encoding='utf-8') as f:
-        for line in f:
-            raw_lines.append(line)
-
-    raw = pdxparser.pdx_parse(file_path)
+    raw = cached_parse(file_path)
     equipments = raw.get('equipments', [None, {}])[1]
 
     # Extract comments for each top-level key
     name_comments = {}
-    for line in raw_lines:
-        line = line.strip()
-        if '=' in line and '#' in line:
-            key_part, comment = line.split('#', 1)
-            key = key_part.split('=')[0].strip()
-            name_comments[key] = comment.strip()
+    with open(file_path, encoding='utf-8') as f:
+        for line in f:
+            comment_pos = line.find('#')
+            if comment_pos == -1 or '=' not in line:
+                continue
+            key = line[:comment_pos].split('=', 1)[0].strip()
+            name_comments[key] = line[comment_pos + 1:].strip()
 
     # Attach comment (name) to each equipment entry
     for key in equipments:
@@ -35,15 +65,19 @@ def parse_ships(file_path):
     return equipments
 
 
+def extract_stat_values(raw):
+    # Unwrap ['=', value] pairs once, so consumers get plain floats
+    return {k: float(v[1]) if isinstance(v, list) else float(v) for k, v in raw.items()}
+
 def extract_module_stats(modules):
     module_data = {}
     for name, content in modules.items():
         if isinstance(content, list) and isinstance(content[1], dict):
             content = content[1]
         mod = {
-            'add_stats': content.get('add_stats', [None, {}])[1],
-            'multiply_stats': content.get('multiply_stats', [None, {}])[1],
-            'add_average_stats': content.get('add_average_stats', [None, {}])[1],
+            'add_stats': extract_stat_values(content.get('add_stats', [None, {}])[1]),
+            'multiply_stats': extract_stat_values(content.get('multiply_stats', [None, {}])[1]),
+            'add_average_stats': extract_stat_values(content.get('add_average_stats', [None, {}])[1]),
         }
         module_data[name] = mod
     return module_data
@@ -61,90 +95,108 @@ def extract_base_stats(ship):
         'max_strength': float(ship.get('max_strength', [None, 0])[1]),
 
     }
-def calculate_ship_stats(ship_name, ship_data, module_data):
-    base = extract_base_stats(ship_data)
-    modules = extract_ship_modules(ship_data)
-
-    final_stats = defaultdict(float)
-    averages = defaultdict(list)
-    speed_mod = 0.0
-
-    for mod in modules:
-        if isinstance(mod, list):
-            mod = mod[1]
-        if mod == 'empty' or mod not in module_data:
-            continue
-
-        stats = module_data[mod]
-
-        for k, v in stats.get('add_stats', {}).items():
-            if isinstance(v, list): v = v[1]
-            final_stats[k] += float(v)
-
-        for k, v in stats.get('multiply_stats', {}).items():
-            if k == 'naval_speed':
-                if isinstance(v, list): v = v[1]
-                speed_mod += float(v)
-
-        for k, v in stats.get('add_average_stats', {}).items():
-            if isinstance(v, list): v = v[1]
-            averages[k].append(float(v))
+def build_modules_frame(module_data):
+    """Flatten module stats into one long (module, op, stat, value) frame."""
+    rows = [(name, op, k, v)
+            for name, stats in module_data.items()
+            for op, op_stats in stats.items()
+            for k, v in op_stats.items()]
+    return pd.DataFrame(rows, columns=['module', 'op', 'stat', 'value'])
+
+def calculate_ship_stats(ships, module_data):
+    """
+    Calculate final stats for all ships in one pass.
+    ships is a list of (ship_name, ship_data) pairs; returns one row per ship.
+    """
+    n = len(ships)
+    if n == 0:
+        return pd.DataFrame()
+    slots = pd.DataFrame(
+        [(i, mod[1] if isinstance(mod, list) else mod)
+         for i, (_, data) in enumerate(ships) for mod in extract_ship_modules(data)],
+        columns=['ship', 'module'])
+    slots = slots[slots['module'] != 'empty']
+
+    # Inner join drops unknown modules and keeps slot order within each ship
+    rows = slots.merge(build_modules_frame(module_data), on='module')
+    add_rows = rows[rows['op'] == 'add_stats']
+    avg_rows = rows[rows['op'] == 'add_average_stats']
+    speed_rows = rows[(rows['op'] == 'multiply_stats') & (rows['stat'] == 'naval_speed')]
+
+    final_stats = add_rows.groupby(['ship', 'stat'], sort=False)['value'].sum().unstack()
+    final_stats = final_stats.reindex(range(n))
+    speed_mod = speed_rows.groupby('ship')['value'].sum().reindex(range(n), fill_value=0.0)
+    base = pd.DataFrame([extract_base_stats(data) for _, data in ships])
 
     final_stats['manpower'] = base['manpower']
-    final_stats['build_cost_ic'] += base['build_cost_ic']
+    no_cost = pd.Series(0.0, index=final_stats.index)
+    final_stats['build_cost_ic'] = final_stats.get('build_cost_ic', no_cost).fillna(0.0) + base['build_cost_ic']
     final_stats['Speed'] = base['naval_speed'] * (1 + speed_mod)
     final_stats['HP'] = base['max_strength']
     final_stats['Org'] = "100"
-    final_stats['Armor'] = final_stats.get('armor_value', 0.0)
-
+    final_stats['Armor'] = final_stats['armor_value'].fillna(0.0) if 'armor_value' in final_stats else 0.0
 
+    averages = avg_rows.groupby(['ship', 'stat'], sort=False)['value'].mean().unstack()
+    final_stats = averages.combine_first(final_stats)
 
-    for k, vals in averages.items():
-        final_stats[k] = sum(vals) / len(vals) if vals else 0
+    final_stats['ship_id'] = [name for name, _ in ships]
+    final_stats['display_name'] = [data.get('_comment_name', '') for _, data in ships]
 
-    final_stats['ship_id'] = ship_name
-    final_stats['display_name'] = ship_data.get('_comment_name', '')  # ⬅️ Add this
-    return final_stats
+    # Order columns by first appearance, as if each ship's stats had been
+    # collected in a dict: its stats in module order, then the fixed columns,
+    # then its averages.
+    fixed = ['manpower', 'build_cost_ic', 'Speed', 'HP', 'Org', 'Armor']
+    key_order = pd.concat([
+        add_rows[['ship', 'stat']].assign(part=0),
+        pd.DataFrame({'ship': 0, 'stat': fixed, 'part': 1}),
+        avg_rows[['ship', 'stat']].assign(part=2),
+        pd.DataFrame({'ship': 0, 'stat': ['ship_id', 'display_name'], 'part': 3}),
+    ]).sort_values(['ship', 'part'], kind='stable')
+    return final_stats[key_order['stat'].drop_duplicates().tolist()]
 
 
 # === RUN ===
-module_files = [
-        "shipdata\\eng_ship_modules.txt",
-        "shipdata\\jap_ship_modules.txt",
-        "shipdata\\fra_ship_modules.txt",
-        "shipdata\\ger_ship_modules.txt",
-        "shipdata\\ita_ship_modules.txt",
-        "shipdata\\sov_ship_modules.txt",
-        "shipdata\\usa_ship_modules.txt",
-        "shipdata\\01_generic_ship_modules.txt",
-
-    # Add more as needed
-]
-all_modules = {}
-for path in module_files:
-    modules = extract_module_stats(parse_modules(path))
-    all_modules.update(modules)
-modules = all_modules
-
-ship_files = [
-    "shipdata\\ship_hull_heavy.txt",
-    "shipdata\\ship_hull_light.txt",
-    "shipdata\\ship_hull_carrier.txt",
-    "shipdata\\ship_hull_very_light.txt",
-    "shipdata\\ship_hull_heavy_cruiser.txt",
-]
-
-results = []
-for ship_file in ship_files:
-    ships = parse_ships(ship_file)
-    for name, pair in ships.items():
-        if isinstance(pair, list) and len(pair) == 2 and isinstance(pair[1], dict):
-            data = pair[1]
-            if 'default_modules' in data and 'manpower' in data:
-                result = calculate_ship_stats(name, data, modules)
-                results.append(result)
-
-
-df = pd.DataFrame(results)
-df.to_csv("hoi4_ship_stats_output.csv", index=False)
-print("✅ Output saved to hoi4_ship_stats_output.csv")
+if __name__ == "__main__":
+    module_files = [
+            "shipdata\\eng_ship_modules.txt",
+            "shipdata\\jap_ship_modules.txt",
+            "shipdata\\fra_ship_modules.txt",
+            "shipdata\\ger_ship_modules.txt",
+            "shipdata\\ita_ship_modules.txt",
+            "shipdata\\sov_ship_modules.txt",
+            "shipdata\\usa_ship_modules.txt",
+            "shipdata\\01_generic_ship_modules.txt",
+
+        # Add more as needed
+    ]
+
+    ship_files = [
+        "shipdata\\ship_hull_heavy.txt",
+        "shipdata\\ship_hull_light.txt",
+        "shipdata\\ship_hull_carrier.txt",
+        "shipdata\\ship_hull_very_light.txt",
+        "shipdata\\ship_hull_heavy_cruiser.txt",
+    ]
+
+    # Parsing is CPU-bound pure Python, so spread the files over processes.
+    # map() submits everything up front; results still come back in order.
+    with ProcessPoolExecutor() as executor:
+        parsed_modules = executor.map(parse_modules, module_files)
+        parsed_ships = executor.map(parse_ships, ship_files)
+
+        all_modules = {}
+        for modules in parsed_modules:
+            all_modules.update(extract_module_stats(modules))
+        modules = all_modules
+
+        ship_list = []
+        for ships in parsed_ships:
+            for name, pair in ships.items():
+                if isinstance(pair, list) and len(pair) == 2 and isinstance(pair[1], dict):
+                    data = pair[1]
+                    if 'default_modules' in data and 'manpower' in data:
+                        ship_list.append((name, data))
+
+    df = calculate_ship_stats(ship_list, modules)
+    df.to_csv("hoi4_ship_stats_output.csv", index=False)
+    print("✅ Output saved to hoi4_ship_stats_output.csv")
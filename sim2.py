@@ -1,32 +1,44 @@
-import random
+import numpy as np
 import pandas as pd
 import json
+import sys
+
+import sim_kernel
+
+# Ship stats are whole numbers in HOI4, so single precision is plenty and
+# halves the memory the combat arrays move around.
+STAT_DTYPE = np.float32
 
 # === Ship and Fleet Classes ===
 class Ship:
+    __slots__ = ("type", "stats", "max_hp", "org", "heavy_attack", "piercing", "armor", "speed")
+
     def __init__(self, ship_type, stats):
         self.type = ship_type
         self.stats = stats
-        self.hp = stats["HP"]
-        self.org = stats["Org"]
-
-    def is_alive(self):
-        return self.hp > 0
-
-    def take_damage(self, damage, max_hp):
-        hp_loss, org_loss = calculate_hp_org_loss(damage, self.hp, self.org, max_hp)
-        self.hp = max(0, self.hp - hp_loss)
-        self.org = max(0, self.org - org_loss)
-        return hp_loss, org_loss
-
-    def get_effective_attack(self):
-        # Apply ORG penalty: 50% attack reduction if ORG is 0
-        return self.stats["hg_attack"] * (0.5 if self.org <= 0 else 1.0)
+        self.max_hp = stats["HP"]
+        self.org = stats["Org"]  # Starting ORG only; live ORG is in Fleet.org
+        self.heavy_attack = stats["hg_attack"]
+        self.piercing = stats["hg_armor_piercing"]
+        self.armor = stats["Armor"]
+        self.speed = stats["Speed"]
 
 class Fleet:
     def __init__(self, composition, ship_templates):
         self.ships = self.create_fleet(composition, ship_templates)
 
+        # Per-ship state is kept as parallel arrays so modifiers can be computed
+        # with array ops and the compiled kernel can work on them in place.
+        self.max_hp = self.stat_array("max_hp")
+        self.heavy_attack = self.stat_array("heavy_attack")
+        self.piercing = self.stat_array("piercing")
+        self.armor = self.stat_array("armor")
+        self.speed = self.stat_array("speed")
+        self.hp = self.max_hp.copy()
+        self.org = self.stat_array("org")
+        self.alive = self.hp > 0
+        self.n_alive = int(self.alive.sum())
+
     def create_fleet(self, composition, ship_templates):
         fleet = []
         for ship_type, count in composition.items():
@@ -36,45 +48,65 @@ class Fleet:
                 fleet.append(Ship(ship_type, ship_templates[ship_type]))
         return fleet
 
-    def get_active_ships(self):
-        return [ship for ship in self.ships if ship.is_alive()]
+    def stat_array(self, stat):
+        """Collect one Ship stat attribute across all ships; missing stats count as 0."""
+        values = np.array([getattr(ship, stat) for ship in self.ships], dtype=STAT_DTYPE)
+        return np.nan_to_num(values)
+
+    def kernel_arrays(self):
+        """Stat arrays in the order expected by sim_kernel.run_battle."""
+        return self.hp, self.org, self.max_hp, self.heavy_attack
 
     def is_defeated(self):
-        return not any(ship.is_alive() for ship in self.ships)
+        return self.n_alive == 0
+
+    def update_alive(self):
+        """Refresh the alive mask after the kernel changed hp."""
+        np.greater(self.hp, 0, out=self.alive)
+        self.n_alive = int(self.alive.sum())
+
 
 # === Combat Mechanics ===
+# All mechanics operate element-wise, so they accept scalars or arrays.
 def calculate_damage_reduction(armor, hg_armor_piercing):
     """Calculate damage reduction based on armor and hg_armor_piercing."""
-    return 90 * (1 - (hg_armor_piercing / armor)) if armor > hg_armor_piercing else 0
-
-def calculate_hp_org_loss(damage, current_hp, current_org, max_hp):
-    """Calculate HP and ORG loss with scaling."""
-    org_loss_multiplier = 1 - (current_hp / max_hp)
-    hp_loss = damage * 0.6  # 60% of damage to HP
-    org_loss = damage * 0.4 * org_loss_multiplier  # ORG loss scales with HP lost
-    return hp_loss, org_loss
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(armor > hg_armor_piercing, 90 * (1 - (hg_armor_piercing / armor)), 0)
 
 def calculate_hit_chance(attacker_speed, target_speed):
     """Calculate hit chance based on speed difference."""
-    return min(1.0, max(0.5, 0.8 + (attacker_speed - target_speed) / 100))
+    return np.clip(0.8 + (attacker_speed - target_speed) / 100, 0.5, 1.0)
 
 def calculate_critical_hit(hg_armor_piercing, armor):
     """Calculate critical hit multiplier if hg_armor_piercing significantly exceeds armor."""
-    return 1.5 if hg_armor_piercing > 1.5 * armor else 1.0
+    return np.where(hg_armor_piercing > 1.5 * armor, 1.5, 1.0)
 
-# === Targeting Logic ===
-def target_enemy(enemy_fleet):
-    """Select a random active enemy ship as the target."""
-    active_enemies = enemy_fleet.get_active_ships()
-    return random.choice(active_enemies) if active_enemies else None
+def calculate_pair_modifiers(attacker, defender):
+    """
+    Hit chance and damage multiplier (critical hit and damage reduction) for
+    every attacker/target pair, as (attackers, defenders) arrays.
+    Both depend only on ship stats, so they stay fixed for a whole battle.
+    """
+    piercing = attacker.piercing[:, None]
+    hit_chance = calculate_hit_chance(attacker.speed[:, None], defender.speed)
+    damage_factor = calculate_critical_hit(piercing, defender.armor)
+    damage_factor *= (1 - calculate_damage_reduction(defender.armor, piercing) / 100)
+    return hit_chance.astype(STAT_DTYPE), damage_factor.astype(STAT_DTYPE)
 
 # === Combat Simulator ===
 class CombatSimulator:
-    def __init__(self, fleet1, fleet2, max_rounds=20):
+    def __init__(self, fleet1, fleet2, max_rounds=20, seed=None):
         self.fleet1 = fleet1
         self.fleet2 = fleet2
         self.max_rounds = max_rounds
-        self.battle_log = []
+        self.rng = np.random.default_rng(seed)
+        # One row per round: round number, then HP/ORG pairs for every ship
+        self.battle_log = np.zeros(
+            (max(max_rounds, 0), 1 + 2 * (len(fleet1.ships) + len(fleet2.ships))), dtype=STAT_DTYPE
+        )
+        self.rounds_logged = 0
+        self.hit_chance_1v2, self.damage_factor_1v2 = calculate_pair_modifiers(fleet1, fleet2)
+        self.hit_chance_2v1, self.damage_factor_2v1 = calculate_pair_modifiers(fleet2, fleet1)
 
     def generate_log_columns(self):
         """Generate dynamic column names for the battle log."""
@@ -89,47 +121,83 @@ class CombatSimulator:
 
     def log_round(self, round_num):
         """Log the state of all ships in the current round."""
-        log_data = [round_num]
+        row = self.battle_log[self.rounds_logged]
+        row[0] = round_num
+        start = 1
         for fleet in [self.fleet1, self.fleet2]:
-            for ship in fleet.ships:
-                log_data.extend([ship.hp, ship.org])
-        self.battle_log.append(log_data)
+            end = start + 2 * len(fleet.ships)
+            row[start:end:2] = fleet.hp
+            row[start + 1:end:2] = fleet.org
+            start = end
+        self.rounds_logged += 1
 
     def run_combat(self):
         """Run the combat simulation and return the battle log as a DataFrame."""
+        # Volleys go through the compiled kernel, so ships fire one at a time
+        # and damage lands immediately, exactly as in run_combat_fast and
+        # run_monte_carlo; only the per-round logging happens here.
+        # Repeated calls keep appending to the same log, so make room for
+        # another full battle.
+        needed = self.rounds_logged + max(self.max_rounds, 0)
+        if needed > len(self.battle_log):
+            self.battle_log = np.resize(self.battle_log, (needed, self.battle_log.shape[1]))
+
+        sim_kernel.seed_rng(self.rng.integers(2**31))
+        hp1, org1, maxhp1, atk1 = self.fleet1.kernel_arrays()
+        hp2, org2, maxhp2, atk2 = self.fleet2.kernel_arrays()
         for round_num in range(1, self.max_rounds + 1):
             if self.fleet1.is_defeated() or self.fleet2.is_defeated():
                 break
 
-            # Fleet 1 attacks
-            for ship in self.fleet1.get_active_ships():
-                target = target_enemy(self.fleet2)
-                if target:
-                    # Apply hit chance and critical hit
-                    if random.random() < calculate_hit_chance(ship.stats["Speed"], target.stats["Speed"]):
-                        damage = ship.get_effective_attack() * calculate_critical_hit(
-                            ship.stats["hg_armor_piercing"], target.stats["Armor"]
-                        )
-                        # Apply damage reduction
-                        damage *= (1 - calculate_damage_reduction(target.stats["Armor"], ship.stats["hg_armor_piercing"]) / 100)
-                        target.take_damage(damage, target.stats["HP"])
-
-            # Fleet 2 attacks
-            for ship in self.fleet2.get_active_ships():
-                target = target_enemy(self.fleet1)
-                if target:
-                    if random.random() < calculate_hit_chance(ship.stats["Speed"], target.stats["Speed"]):
-                        damage = ship.get_effective_attack() * calculate_critical_hit(
-                            ship.stats["hg_armor_piercing"], target.stats["Armor"]
-                        )
-                        damage *= (1 - calculate_damage_reduction(target.stats["Armor"], ship.stats["hg_armor_piercing"]) / 100)
-                        target.take_damage(damage, target.stats["HP"])
+            sim_kernel.fleet_attack(hp1, org1, atk1, hp2, org2, maxhp2,
+                                    self.hit_chance_1v2, self.damage_factor_1v2)
+            sim_kernel.fleet_attack(hp2, org2, atk2, hp1, org1, maxhp1,
+                                    self.hit_chance_2v1, self.damage_factor_2v1)
+            self.fleet1.update_alive()
+            self.fleet2.update_alive()
 
             # Log the round
             self.log_round(round_num)
 
         # Create DataFrame for battle log
-        return pd.DataFrame(self.battle_log, columns=self.generate_log_columns())
+        battle_log_df = pd.DataFrame(
+            self.battle_log[:self.rounds_logged], columns=self.generate_log_columns()
+        )
+        battle_log_df["Round"] = battle_log_df["Round"].astype(int)
+        return battle_log_df
+
+    def run_combat_fast(self, seed=None):
+        """
+        Run the combat simulation with the compiled kernel, without a battle log.
+        Fleet state is updated in place; returns the number of rounds fought.
+        """
+        if seed is None:
+            seed = self.rng.integers(2**31)
+        rounds = sim_kernel.run_battle(
+            *self.fleet1.kernel_arrays(), *self.fleet2.kernel_arrays(),
+            self.hit_chance_1v2, self.damage_factor_1v2,
+            self.hit_chance_2v1, self.damage_factor_2v1,
+            self.max_rounds, seed
+        )
+        self.fleet1.update_alive()
+        self.fleet2.update_alive()
+        return rounds
+
+    def run_monte_carlo(self, n_battles, seed=None):
+        """
+        Replay the battle n_battles times from the fleets' current state.
+        Returns a DataFrame with the number of surviving ships per fleet.
+        """
+        rng = self.rng if seed is None else np.random.default_rng(seed)
+        seeds = rng.integers(0, 2**31, size=n_battles)
+        survivors = np.empty((n_battles, 2), dtype=np.int32)
+        sim_kernel.run_batch(
+            *self.fleet1.kernel_arrays(), *self.fleet2.kernel_arrays(),
+            self.hit_chance_1v2, self.damage_factor_1v2,
+            self.hit_chance_2v1, self.damage_factor_2v1,
+            self.max_rounds, seeds, survivors
+        )
+        return pd.DataFrame(survivors, columns=["Fleet1 Survivors", "Fleet2 Survivors"])
 
 # === Configuration Loader ===
 def load_ship_templates(csv_path):
@@ -139,8 +207,7 @@ def load_ship_templates(csv_path):
     """
     df = pd.read_csv(csv_path)
     template_dict = {}
-    for _, row in df.iterrows():
-        stats = row.to_dict()
+    for stats in df.to_dict(orient="records"):
         ship_id = stats["ship_id"]
         name = str(stats.get("display_name", "") or "").strip()
 
@@ -160,7 +227,10 @@ def load_config(config_path):
     return {
         "fleet1": {ship: data["fleet1"].count(ship) for ship in set(data["fleet1"])},
         "fleet2": {ship: data["fleet2"].count(ship) for ship in set(data["fleet2"])},
-        "max_rounds": data.get("max_rounds", 20)
+        "max_rounds": data.get("max_rounds", 20),
+        "monte_carlo_runs": data.get("monte_carlo_runs", 0),
+        "seed": data.get("seed"),
+        "verbose": data.get("verbose", True)
     }
 
 
@@ -175,10 +245,20 @@ if __name__ == "__main__":
     fleet2 = Fleet(config["fleet2"], ship_templates)
     max_rounds = config["max_rounds"]
 
-    # Run simulation
-    simulator = CombatSimulator(fleet1, fleet2, max_rounds)
-    battle_log_df = simulator.run_combat()
+    # Run simulation; replays start from the current fleet state, so go first
+    simulator = CombatSimulator(fleet1, fleet2, max_rounds, config["seed"])
+    if config["monte_carlo_runs"]:
+        replays = simulator.run_monte_carlo(config["monte_carlo_runs"])
+
+    # The round-by-round log is only useful when someone reads it, and
+    # to_string formatting is slow for wide fleets; tab-separated is not.
+    if config["verbose"]:
+        battle_log_df = simulator.run_combat()
+        print("\n===== Battle Simulation Results =====\n")
+        battle_log_df.to_csv(sys.stdout, sep="\t", index=False)
 
-    # Print results
-    print("\n===== Battle Simulation Results =====\n")
-    print(battle_log_df.to_string(index=False))
+    if config["monte_carlo_runs"]:
+        print(f"\n===== Monte Carlo Results ({len(replays)} battles) =====\n")
+        print(replays.describe().to_string())
+        print(f"\nFleet1 wins: {(replays['Fleet2 Survivors'] == 0).mean():.1%}")
+        print(f"Fleet2 wins: {(replays['Fleet1 Survivors'] == 0).mean():.1%}")
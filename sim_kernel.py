@@ -0,0 +1,113 @@
+"""
+Compiled combat kernel for running many battles quickly.
+
+Implements the combat rules as scalar loops over flat stat arrays so Numba can
+compile them to native code. Ships attack one at a time and damage lands
+immediately, exactly like the original per-ship simulation. sim2.py drives
+every battle through here, whether logged round by round, fought once, or
+replayed in bulk.
+
+Hit chance and damage multipliers are passed in as (attackers, defenders)
+matrices computed by sim2.calculate_pair_modifiers.
+"""
+import numpy as np
+from numba import njit, prange
+
+
+# === Targeting Logic ===
+@njit(cache=True)
+def alive_indices(hp):
+    """Indices of the ships in hp that are still afloat."""
+    pool = np.empty(hp.shape[0], dtype=np.int64)
+    active = 0
+    for j in range(hp.shape[0]):
+        if hp[j] > 0:
+            pool[active] = j
+            active += 1
+    return pool[:active]
+
+@njit(cache=True)
+def seed_rng(seed):
+    """Seed the random generator the kernels draw from."""
+    np.random.seed(seed)
+
+# === Battle Kernel ===
+@njit(cache=True, fastmath=True)
+def fleet_attack(hp_a, org_a, atk_a, hp_d, org_d, maxhp_d, hit_chance, damage_factor):
+    """
+    Every active attacker fires once at a random active defender.
+    Returns the number of defenders sunk.
+    """
+    # Targeting pool of live defenders; sunk ships are swapped out of the
+    # live prefix so every pick is O(1).
+    targets = alive_indices(hp_d)
+    active = targets.shape[0]
+    for i in range(hp_a.shape[0]):
+        if hp_a[i] <= 0:
+            continue
+        if active == 0:
+            break
+        pick = np.random.randint(0, active)
+        target = targets[pick]
+        if np.random.random() >= hit_chance[i, target]:
+            continue
+
+        # Apply ORG penalty: 50% attack reduction if ORG is 0
+        damage = atk_a[i] * (0.5 if org_a[i] <= 0 else 1.0) * damage_factor[i, target]
+
+        org_loss_multiplier = 1 - hp_d[target] / maxhp_d[target]
+        hp_d[target] = max(0.0, hp_d[target] - damage * 0.6)
+        org_d[target] = max(0.0, org_d[target] - damage * 0.4 * org_loss_multiplier)
+        if hp_d[target] <= 0:
+            active -= 1
+            targets[pick] = targets[active]
+    return targets.shape[0] - active
+
+@njit(cache=True)
+def count_alive(hp):
+    """Number of ships in hp that are still afloat."""
+    alive = 0
+    for j in range(hp.shape[0]):
+        if hp[j] > 0:
+            alive += 1
+    return alive
+
+@njit(cache=True, fastmath=True)
+def run_battle(hp1, org1, maxhp1, atk1, hp2, org2, maxhp2, atk2,
+               hit_chance_1v2, damage_factor_1v2, hit_chance_2v1, damage_factor_2v1,
+               max_rounds, seed):
+    """
+    Fight one battle in place on the hp/org arrays of both fleets.
+    Returns the number of rounds fought.
+    """
+    seed_rng(seed)
+    alive1 = count_alive(hp1)
+    alive2 = count_alive(hp2)
+    rounds = 0
+    for _ in range(max_rounds):
+        if alive1 == 0 or alive2 == 0:
+            break
+        alive2 -= fleet_attack(hp1, org1, atk1, hp2, org2, maxhp2, hit_chance_1v2, damage_factor_1v2)
+        alive1 -= fleet_attack(hp2, org2, atk2, hp1, org1, maxhp1, hit_chance_2v1, damage_factor_2v1)
+        rounds += 1
+    return rounds
+
+@njit(parallel=True, cache=True)
+def run_batch(hp1, org1, maxhp1, atk1, hp2, org2, maxhp2, atk2,
+              hit_chance_1v2, damage_factor_1v2, hit_chance_2v1, damage_factor_2v1,
+              max_rounds, seeds, out_survivors):
+    """
+    Fight one independent battle per seed, in parallel, starting every battle
+    from the given hp/org arrays (which are left untouched).
+    Writes the ships left afloat on each side to out_survivors[b, 0:2].
+    """
+    for b in prange(seeds.shape[0]):
+        b_hp1 = hp1.copy()
+        b_org1 = org1.copy()
+        b_hp2 = hp2.copy()
+        b_org2 = org2.copy()
+        run_battle(b_hp1, b_org1, maxhp1, atk1, b_hp2, b_org2, maxhp2, atk2,
+                   hit_chance_1v2, damage_factor_1v2, hit_chance_2v1, damage_factor_2v1,
+                   max_rounds, seeds[b])
+        out_survivors[b, 0] = count_alive(b_hp1)
+        out_survivors[b, 1] = count_alive(b_hp2)